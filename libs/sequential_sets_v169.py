@@ -2,14 +2,25 @@ from collections.abc import Hashable, MutableSequence, MutableSet, Sequence, Set
 from typing import Any, Iterable, Iterator, Self, TypeVar, overload
 
 T = TypeVar("T")
+HASH_MASK = 2**64 - 1
+
+# Shared by all empty sets until their first write, must never be mutated
+_EMPTY_VALUES: list = []
+_EMPTY_INDEXES: dict = {}
 
 
 class SequentialSet(Sequence[T], Set[T]):
     __slots__ = "indexes", "values"
 
     def __init__(self, iterable: Iterable[T] = ()):
-        self.values: list[T] = list(dict.fromkeys(iterable))
-        self.indexes: dict[T, int] = {v: i for i, v in enumerate(self.values)}
+        self.values: list[T] = list(dict.fromkeys(iterable)) or _EMPTY_VALUES
+        self.indexes: dict[T, int] = (
+            {v: i for i, v in enumerate(self.values)} if self.values else _EMPTY_INDEXES
+        )
+
+    def _allocate(self) -> None:
+        if self.values is _EMPTY_VALUES:
+            self.values, self.indexes = [], {}
 
     def __contains__(self, element: Any) -> bool:
         return element in self.indexes
@@ -60,20 +71,29 @@ class HashableSequentialSet(SequentialSet[T], Hashable):
 
     def __hash__(self) -> int:
         if self.hash is None:
-            self.hash = sum(map(hash, self.values))
+            h = 0
+            for value in self.values:
+                h = (h + hash(value)) & HASH_MASK
+            self.hash = h
         return self.hash
 
 
 class MutableSequentialSet(SequentialSet[T], MutableSequence[T], MutableSet[T]):
     __slots__ = ()
 
+    def __iter__(self) -> Iterator[T]:
+        # Iterators have to see later additions, so bind them to a real list
+        self._allocate()
+        return iter(self.values)
+
     def __delitem__(self, i: int | slice) -> None:
         if not isinstance(i, int):
             raise TypeError("Why would you want to delete slice of a set?")
         value = self.values.pop(i)
         del self.indexes[value]
-        for index, value in enumerate(self.values[i:], i):
-            self.indexes[value] = index
+        values, indexes = self.values, self.indexes
+        for k in range(i, len(values)):
+            indexes[values[k]] = k
 
     @overload
     def __setitem__(self, i: int, value: T) -> None:
@@ -100,18 +120,22 @@ class MutableSequentialSet(SequentialSet[T], MutableSequence[T], MutableSet[T]):
     def insert(self, index: int, value: T) -> None:
         if value in self.indexes:
             raise ValueError(f"{value!r} is already in the set")
+        self._allocate()
         self.values.insert(index, value)
-        for i, element in enumerate(self.values[index:], index):
-            self.indexes[element] = i
+        values, indexes = self.values, self.indexes
+        for k in range(index, len(values)):
+            indexes[values[k]] = k
 
     def add(self, value: T) -> None:
         if value not in self.indexes:
+            self._allocate()
             self.indexes[value] = len(self.values)
             self.values.append(value)
 
     def push(self, element: T) -> int:
         i = self.indexes.get(element, len(self.indexes))
         if i == len(self.values):
+            self._allocate()
             self.indexes[element] = i
             self.values.append(element)
         return i
@@ -135,15 +159,24 @@ class MutableSequentialSet(SequentialSet[T], MutableSequence[T], MutableSet[T]):
 class MutableOrHashableSequentialSet(
     SequentialSet[T], MutableSequence[T], MutableSet[T], Hashable
 ):
-    __slots__ = ["hash"]
+    __slots__ = ["hash", "_hash_acc"]
 
     def __init__(self, iterable: Iterable[T] = ()):
         super().__init__(iterable)
         self.hash = None
+        h = 0
+        for value in self.values:
+            h = (h + hash(value)) & HASH_MASK
+        self._hash_acc = h
+
+    def __iter__(self) -> Iterator[T]:
+        # Iterators have to see later additions, so bind them to a real list
+        self._allocate()
+        return iter(self.values)
 
     def __hash__(self):
         if self.hash is None:
-            self.hash = sum(map(hash, self.values))
+            self.hash = self._hash_acc
         return self.hash
 
     def __delitem__(self, index: int | slice) -> None:
@@ -153,8 +186,10 @@ class MutableOrHashableSequentialSet(
             raise TypeError("Why would you want to delete slice of a set?")
         value = self.values.pop(index)
         del self.indexes[value]
-        for i, value in enumerate(self.values[index:], index):
-            self.indexes[value] = i
+        self._hash_acc = (self._hash_acc - hash(value)) & HASH_MASK
+        values, indexes = self.values, self.indexes
+        for k in range(index, len(values)):
+            indexes[values[k]] = k
 
     @overload
     def __setitem__(self, i: int, value: T) -> None:
@@ -179,20 +214,28 @@ class MutableOrHashableSequentialSet(
         del self.indexes[old_value]
         self.values[i] = new_value
         self.indexes[new_value] = i
+        self._hash_acc = (
+            self._hash_acc - hash(old_value) + hash(new_value)
+        ) & HASH_MASK
 
     def insert(self, index: int, value: T) -> None:
         if self.hash is not None:
             raise ValueError("It is prohibited to modify hashable set")
         if value in self.indexes:
             raise ValueError(f"{value!r} is already in the set")
+        self._allocate()
         self.values.insert(index, value)
-        for i, element in enumerate(self.values[index:], index):
-            self.indexes[element] = i
+        self._hash_acc = (self._hash_acc + hash(value)) & HASH_MASK
+        values, indexes = self.values, self.indexes
+        for k in range(index, len(values)):
+            indexes[values[k]] = k
 
     def add(self, value: T) -> None:
         if value not in self.indexes:
             if self.hash is not None:
                 raise ValueError("It is prohibited to modify hashable set")
+            self._hash_acc = (self._hash_acc + hash(value)) & HASH_MASK
+            self._allocate()
             self.indexes[value] = len(self.values)
             self.values.append(value)
 
@@ -201,6 +244,8 @@ class MutableOrHashableSequentialSet(
         if i == len(self.values):
             if self.hash is not None:
                 raise ValueError("It is prohibited to modify hashable set")
+            self._hash_acc = (self._hash_acc + hash(element)) & HASH_MASK
+            self._allocate()
             self.indexes[element] = i
             self.values.append(element)
         return i
@@ -217,6 +262,7 @@ class MutableOrHashableSequentialSet(
         if self.hash is not None:
             raise ValueError("It is prohibited to modify hashable set")
         i = self.indexes.pop(value)
+        self._hash_acc = (self._hash_acc - hash(value)) & HASH_MASK
         filler = self.values.pop()
         if i < len(self.indexes):
             self.values[i] = filler
@@ -228,6 +274,27 @@ class MutableOrHashableSequentialSet(
 class DynSet(MutableSequentialSet[T], HashableSequentialSet[T]):
     __slots__ = ()
 
+    @classmethod
+    def _acquire(cls, iterable: Iterable[T] = ()) -> "DynSet[T]":
+        if cls is not DynSet or not _DYNSET_POOL:
+            return cls(iterable)
+        dynset = _DYNSET_POOL.pop()
+        dynset.update(iterable)
+        return dynset
+
+    def _release(self) -> None:
+        if type(self) is not DynSet:
+            return
+        if self.hash is not None:
+            raise ValueError("It is prohibited to modify hashable set")
+        if any(dynset is self for dynset in _DYNSET_POOL):
+            raise ValueError("This set has already been released")
+        if self.values is not _EMPTY_VALUES:
+            self.values.clear()
+            self.indexes.clear()
+        self.hash = None
+        _DYNSET_POOL.append(self)
+
     def __delitem__(self, index: int | slice) -> None:
         if self.hash is not None:
             raise ValueError("It is prohibited to modify hashable set")
@@ -257,3 +324,6 @@ class DynSet(MutableSequentialSet[T], HashableSequentialSet[T]):
         if self.hash is not None:
             raise ValueError("It is prohibited to modify hashable set")
         super().remove(value)
+
+
+_DYNSET_POOL: list[DynSet] = []
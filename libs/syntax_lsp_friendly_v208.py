@@ -1,18 +1,33 @@
-from dataclasses import dataclass
+from collections import deque
+from dataclasses import dataclass, field
 from functools import cached_property
-from itertools import chain
-from typing import Callable, NamedTuple, Self, no_type_check
+from io import StringIO
+from itertools import chain, groupby
+from operator import not_
+from typing import Callable, Iterable, NamedTuple, Self, no_type_check
 from libs.sequential_sets_v169 import DynSet as Set
-from .token_parsers import get_keyword_parser, TOKEN_PARSERS
+from .token_parsers import (
+    get_keyword_parser,
+    get_keyword_trie,
+    scan_keyword,
+    KeywordTrie,
+    TOKEN_PARSERS,
+)
+
+# Cells of LR1Parser.action_table hold (kind << ACTION_ARG_BITS) | argument
+SHIFT, REDUCE, ACCEPT = 1, 2, 3
+ACTION_ARG_BITS = 28
+ACTION_ARG_MASK = (1 << ACTION_ARG_BITS) - 1
 
 
 def split_str(string: str, sep: str, maxsplit: int = -1) -> list[str]:
+    # Every run of n empty words becomes a single word of n - 1 separators
     result: list[str] = []
-    # for is_space, word in groupby(string.split(sep, maxsplit), lambda w: w == ""):
-    for word in string.split(sep, maxsplit):
-        if word == "" and result and (not result[-1] or result[-1].startswith(sep)):
-            word = result.pop() + sep
-        result.append(word)
+    for is_space, words in groupby(string.split(sep, maxsplit), not_):
+        if is_space:
+            result.append(sep * (sum(1 for _ in words) - 1))
+        else:
+            result.extend(words)
     return result
 
 
@@ -21,17 +36,20 @@ class Rule(NamedTuple):
     body: tuple[str, ...]
 
 
-def exclude_nones(iterable):
-    for element in iterable:
-        if element is None:
-            continue
-        yield element
+class IntRule(NamedTuple):
+    head: int
+    body: tuple[int, ...]
 
 
-class LR1Item(NamedTuple):
+@dataclass(slots=True, frozen=True)
+class LR1Item:
     dot: int
+    rule_id: int
+    follower_id: int
     rule: Rule
     follower: str | None
+    next_sym: int | None = field(repr=False, compare=False)
+    tail_follower: tuple[int, ...] = field(repr=False, compare=False)
 
     def __str__(self):
         head, body = self.rule
@@ -55,20 +73,28 @@ class Node(NamedTuple):
     value: str | list[Self]
 
     def as_tree(self) -> str:
-        head = f"{self.span[0]}..{self.span[1]-1} {self.name}"
-        if isinstance(self.value, str):
-            return head + f" ─ {self.value!r}"
-        children = [child.as_tree() for child in self.value]
-        for i, child in enumerate(children[:-1]):
-            children[i] = "├── " + ("\n│   ").join(child.split("\n"))
-        children[-1] = "└── " + ("\n    ").join(children[-1].split("\n"))
-        return f"{head}\n" + "\n".join(children)
+        tree = StringIO()
+        stack: list[tuple[Self, str, str]] = [(self, "", "")]
+        while stack:
+            node, head_prefix, prefix = stack.pop()
+            head = f"{node.span[0]}..{node.span[1]-1} {node.name}"
+            if isinstance(node.value, str):
+                head += f" ─ {node.value!r}"
+            elif node.value:
+                stack.append((node.value[-1], prefix + "└── ", prefix + "    "))
+                stack.extend(
+                    (child, prefix + "├── ", prefix + "│   ")
+                    for child in reversed(node.value[:-1])
+                )
+            tree.write(head_prefix + head.replace("\n", "\n" + prefix) + "\n")
+        return tree.getvalue()[:-1]
 
 
 @dataclass
 class Syntax:
     rule_list: list[Rule]
     token_parsers: dict[str, Callable[[str, int], int]]
+    keywords: tuple[str, ...] = ()
 
     @classmethod
     def from_description(
@@ -90,7 +116,7 @@ class Syntax:
     ) -> Self:
         if extra_parsers is None:
             extra_parsers = {}
-        token_parsers = {}
+        token_parsers, keywords = {}, []
         nodes = {head for head, _ in rules}
         tokens = Set(t for _, ts in rules for t in ts if t not in nodes)
         for token in tokens:
@@ -100,7 +126,8 @@ class Syntax:
                 token_parsers[token] = TOKEN_PARSERS[token]
             else:
                 token_parsers[token] = get_keyword_parser(token)
-        return cls(rules, token_parsers)
+                keywords.append(token)
+        return cls(rules, token_parsers, tuple(keywords))
 
     @cached_property
     def nodes(self) -> Set[str]:
@@ -119,68 +146,173 @@ class Syntax:
         return Set(symbol for symbol in self.symbols if symbol not in self.nodes)
 
     @cached_property
-    def rules(self) -> dict[str, Set[Rule]]:
-        rules: dict[str, Set[Rule]] = {node: Set() for node in self.nodes}
-        for rule in self.rule_list:
-            rules[rule.head].add(rule)
+    def rules(self) -> dict[str, list[Rule]]:
+        rules: dict[str, list[Rule]] = {node: [] for node in self.nodes}
+        for rule in dict.fromkeys(self.rule_list):
+            rules[rule.head].append(rule)
         return rules
 
     @cached_property
-    def prefixes(self) -> dict[str, Set[str | None]]:
-        prefixes: dict[str, Set[str | None]]
-        prefixes = {node: Set() for node in self.nodes}
-        prefixes |= {token: Set([token]) for token in self.tokens}
-        done = False
-        while not done:
-            # TODO: check how slow is this thing with "done"
-            done = True
-            for node, body in self.rule_list:
-                while body and body[0] is not None:
-                    for first in exclude_nones(prefixes[body[0]]):
-                        if first not in prefixes[node]:
-                            done = False
-                            prefixes[node].add(first)
-                    if None not in prefixes[body[0]]:
+    def symbol_names(self) -> list[str | None]:
+        # Symbol 0 is the end of input, terminals go before nodes
+        return [None, *self.tokens, *self.nodes]
+
+    @cached_property
+    def symbol_ids(self) -> dict[str | None, int]:
+        return {symbol: k for k, symbol in enumerate(self.symbol_names)}
+
+    @cached_property
+    def rule_table(self) -> list[Rule]:
+        root_rules = (Rule(None, (node,)) for node in self.nodes)  # type: ignore
+        return list(dict.fromkeys(chain(self.rule_list, root_rules)))
+
+    @cached_property
+    def rule_ids(self) -> dict[Rule, int]:
+        return {rule: k for k, rule in enumerate(self.rule_table)}
+
+    @cached_property
+    def int_rules(self) -> list[IntRule]:
+        ids = self.symbol_ids
+        return [
+            IntRule(ids[head], tuple(ids[symbol] for symbol in body))
+            for head, body in self.rule_table
+        ]
+
+    @cached_property
+    def rule_lens(self) -> list[int]:
+        return [len(body) for _, body in self.int_rules]
+
+    @cached_property
+    def _rule_ids_by_head(self) -> dict[int, list[int]]:
+        rule_ids: dict[int, list[int]] = {}
+        for k, (head, _) in enumerate(self.int_rules):
+            if head:
+                rule_ids.setdefault(head, []).append(k)
+        return rule_ids
+
+    @cached_property
+    def _first_tbl(self) -> list[tuple[frozenset[int], bool]]:
+        terminals = len(self.tokens) + 1
+        prefixes = [{s} if s < terminals else set() for s in range(len(self.symbol_names))]
+        deps: list[list[int]] = [[] for _ in prefixes]
+        for k, (head, body) in enumerate(self.int_rules):
+            if head:
+                for symbol in dict.fromkeys(body):
+                    deps[symbol].append(k)
+        nullable = {head for head, body in self.int_rules if head and not body}
+        worklist = deque(chain(range(1, terminals), nullable))
+        while worklist:
+            for k in deps[worklist.popleft()]:
+                node, body = self.int_rules[k]
+                first = prefixes[node]
+                size = len(first)
+                for symbol in body:
+                    first |= prefixes[symbol]
+                    if symbol not in nullable:
                         break
-                    body = body[1:]
                 else:
-                    if None not in prefixes[node]:
-                        done = False
-                        prefixes[node].add(None)
+                    if node not in nullable:
+                        nullable.add(node)
+                        size = -1
+                if len(first) != size:
+                    worklist.append(node)
+        return [(frozenset(first), s in nullable) for s, first in enumerate(prefixes)]
+
+    @cached_property
+    def prefixes(self) -> dict[str, set[str | None]]:
+        names = self.symbol_names
+        prefixes: dict[str, set[str | None]] = {}
+        for s, (first, nullable) in enumerate(self._first_tbl[1:], 1):
+            prefixes[names[s]] = {names[t] for t in first}  # type: ignore
+            if nullable:
+                prefixes[names[s]].add(None)  # type: ignore
         return prefixes
 
+    @cached_property
+    def _seq_first_cache(self) -> dict[tuple[int, ...], tuple[frozenset[int], bool]]:
+        return {}
+
+    def _seq_first(self, sequence: tuple[int, ...]) -> tuple[frozenset[int], bool]:
+        if (result := self._seq_first_cache.get(sequence)) is None:
+            first_tbl = self._first_tbl
+            firsts, nullable = frozenset(), True
+            for symbol in sequence:
+                first, nullable = first_tbl[symbol]
+                firsts |= first
+                if not nullable:
+                    break
+            result = self._seq_first_cache[sequence] = (firsts, nullable)
+        return result
+
     def get_sequence_prefixes(self, sequence: tuple[str, ...]) -> Set[str | None]:
-        prefixes: Set[str | None]
-        i, prefixes = 0, Set([None])
-        while None in prefixes and i < len(sequence) and sequence[i] is not None:
-            prefixes.remove(None)
-            prefixes.update(self.prefixes[sequence[i]])  # I am here
-            i += 1
-        return prefixes
+        names, ids = self.symbol_names, self.symbol_ids
+        firsts, nullable = self._seq_first(tuple(ids[symbol] for symbol in sequence))
+        return Set(chain((names[s] for s in firsts), [None] if nullable else []))
 
-    def lr1_closure(self, core_items: Set[LR1Item]) -> Set[LR1Item]:
-        for item in (item_set := Set(core_items)):
-            followers = self.get_sequence_prefixes(item.tail() + (item.follower,))
-            for rule in self.rules.get(item.next(), ()):
-                for follower in followers:
-                    new_item = LR1Item(0, rule, follower)
-                    item_set.add(new_item)
+    @cached_property
+    def _items(self) -> dict[tuple[int, int, int], LR1Item]:
+        return {}
+
+    def item(self, dot: int, rule_id: int, follower_id: int) -> LR1Item:
+        key = (rule_id, dot, follower_id)
+        if (item := self._items.get(key)) is None:
+            body = self.int_rules[rule_id].body
+            item = self._items[key] = LR1Item(
+                dot,
+                rule_id,
+                follower_id,
+                self.rule_table[rule_id],
+                self.symbol_names[follower_id],
+                body[dot] if dot < len(body) else None,
+                body[dot + 1:] + (follower_id,),
+            )
+        return item
+
+    def lr1_closure(self, core_items: Iterable[LR1Item]) -> Set[LR1Item]:
+        rules_by_head, seq_first = self._rule_ids_by_head, self._seq_first
+        get_item = self.item
+        for item in (item_set := Set._acquire(core_items)):
+            if rule_ids := rules_by_head.get(item.next_sym):  # type: ignore
+                # tail_follower ends with a terminal, so it is never nullable
+                followers, _ = seq_first(item.tail_follower)
+                for rule_id in rule_ids:
+                    for follower in followers:
+                        item_set.add(get_item(0, rule_id, follower))
         return item_set
 
     def get_parser_for(self, node: str) -> "LR1Parser":
         return LR1Parser(self, node)
 
+    @cached_property
+    def keyword_trie(self) -> KeywordTrie:
+        return get_keyword_trie(self.keywords)
+
+    @cached_property
+    def token_order(self) -> dict[str, int]:
+        return {token: k for k, token in enumerate(self.token_parsers)}
+
+    @cached_property
+    def scanners(self) -> list[tuple[int, str, Callable[[str, int], int]]]:
+        keywords = set(self.keywords)
+        return [
+            (k, token, scanner)
+            for k, (token, scanner) in enumerate(self.token_parsers.items())
+            if token not in keywords
+        ]
+
     def scan_token(self, source: str, i: int = 0) -> tuple[str | None, tuple[int, int]]:
         if i >= len(source):
             return (None, (i, i))
-        max_len, recognised_token = -1, "???"
-        print("scan:", source[i:i+5])
-        for token, scanner in self.token_parsers.items():
+        # Ties go to the token that comes first in token_parsers
+        max_len, order, recognised_token = -1, 0, "???"
+        keyword, length = scan_keyword(self.keyword_trie, source, i)
+        if keyword is not None:
+            max_len, order, recognised_token = length, self.token_order[keyword], keyword
+        for k, token, scanner in self.scanners:
             try:
                 length = scanner(source, i)
-                print(token, "->", length)
-                if length > max_len:
-                    max_len, recognised_token = length, token
+                if length > max_len or length == max_len and k < order:
+                    max_len, order, recognised_token = length, k, token
             except ValueError:
                 pass
         if max_len == -1:
@@ -199,38 +331,59 @@ class LR1Parser:
     @cached_property
     def item_sets_and_gotos(
         self,
-    ) -> tuple[Set[Set[LR1Item]], dict[tuple[int, str], int]]:
-        root_item = LR1Item(0, Rule(None, (self.root_node,)), None)  # type: ignore
-        item_sets, gotos = Set([Set([root_item])]), {}
-        for i, item_set in enumerate(map(self.syntax.lr1_closure, item_sets)):
-            # TODO: use more efficient way to find next set
-            for next_symbol in chain(self.syntax.symbols):
-                if next_set := Set(
-                    LR1Item(i + 1, rule, follower)
-                    for i, rule, follower in item_set
-                    if i < len(rule.body) and rule.body[i] == next_symbol
-                ):
-                    gotos[i, next_symbol] = item_sets.push(next_set)
-        return item_sets, gotos
+    ) -> tuple[
+        list[frozenset[LR1Item]],
+        dict[tuple[int, str], int],
+        list[tuple[LR1Item, ...]],
+    ]:
+        syntax = self.syntax
+        item, names = syntax.item, syntax.symbol_names
+        root_rule = Rule(None, (self.root_node,))  # type: ignore
+        root_item = item(0, syntax.rule_ids[root_rule], 0)
+        item_sets, gotos, closures = [frozenset([root_item])], {}, []
+        indexes = {item_sets[0]: 0}
+        for i, item_set in enumerate(item_sets):
+            closure_set = syntax.lr1_closure(item_set)
+            closure = tuple(closure_set)
+            closure_set._release()
+            closures.append(closure)
+            buckets: dict[int, list[LR1Item]] = {}
+            for core_item in closure:
+                if (next_symbol := core_item.next_sym) is not None:
+                    buckets.setdefault(next_symbol, []).append(
+                        item(core_item.dot + 1, core_item.rule_id, core_item.follower_id)
+                    )
+            for next_symbol, items in buckets.items():
+                next_set = frozenset(items)
+                j = indexes.setdefault(next_set, len(item_sets))
+                if j == len(item_sets):
+                    item_sets.append(next_set)
+                gotos[i, names[next_symbol]] = j
+        return item_sets, gotos, closures
 
     @cached_property
-    def item_sets(self) -> Set[Set[LR1Item]]:
+    def item_sets(self) -> list[frozenset[LR1Item]]:
         return self.item_sets_and_gotos[0]
 
     @cached_property
     def gotos(self) -> dict[tuple[int, str], int]:
         return self.item_sets_and_gotos[1]
 
+    @cached_property
+    def closures(self) -> list[tuple[LR1Item, ...]]:
+        return self.item_sets_and_gotos[2]
+
     @cached_property
     def actions(self) -> dict[tuple[int, str | None], tuple]:
         actions: dict[tuple[int, str | None], tuple] = {}
-        for i, item_set in enumerate(map(self.syntax.lr1_closure, self.item_sets)):
+        rule_lens = self.syntax.rule_lens
+        for i, item_set in enumerate(self.closures):
             for terminal, j in (
                 (t, j) for t in self.syntax.tokens if (j := self.gotos.get((i, t)))
             ):
                 assert (i, terminal) not in actions, "Conflict!"
                 actions[i, terminal] = ("shift", j)
-            for item in filter(lambda item: item.dot == len(item.rule.body), item_set):
+            for item in filter(lambda item: item.dot == rule_lens[item.rule_id], item_set):
                 if item.rule.head is not None:
                     assert (i, item.follower) not in actions, "Conflict!"
                     actions[i, item.follower] = ("reduce", item.rule)
@@ -239,28 +392,62 @@ class LR1Parser:
                     actions[i, None] = ("accept",)
         return actions
 
+    @cached_property
+    def tables(self) -> tuple[list[list[int]], list[list[int]]]:
+        symbol_ids, rule_ids = self.syntax.symbol_ids, self.syntax.rule_ids
+        action_table = [[0] * len(symbol_ids) for _ in self.item_sets]
+        goto_table = [[0] * len(symbol_ids) for _ in self.item_sets]
+        for (i, terminal), action in self.actions.items():
+            match action:
+                case ("shift", state):
+                    code = SHIFT << ACTION_ARG_BITS | state
+                case ("reduce", rule):
+                    code = REDUCE << ACTION_ARG_BITS | rule_ids[rule]
+                case ("accept",):
+                    code = ACCEPT << ACTION_ARG_BITS
+            action_table[i][symbol_ids[terminal]] = code
+        for (i, symbol), j in self.gotos.items():
+            goto_table[i][symbol_ids[symbol]] = j
+        return action_table, goto_table
+
+    @cached_property
+    def action_table(self) -> list[list[int]]:
+        return self.tables[0]
+
+    @cached_property
+    def goto_table(self) -> list[list[int]]:
+        return self.tables[1]
+
     @no_type_check  # This does not remove signature, right?
     def parse(self, source: str, offset: int = 0) -> Node:
+        action_table, goto_table = self.tables
+        symbol_ids, rule_table = self.syntax.symbol_ids, self.syntax.rule_table
+        int_rules, rule_lens = self.syntax.int_rules, self.syntax.rule_lens
+        scan_token = self.syntax.scan_token
         stack = [0]
-        token, (i, j) = self.syntax.scan_token(source, offset)
+        token, (i, j) = scan_token(source, offset)
         while True:
-            match self.actions.get((stack[-1], token)):
-                case None:
-                    expected = {tok for i, tok in self.actions if i == stack[-1]}
-                    raise ValueError(
-                        f"Unexpected token at [{i}..{j-1}]: {token!r}\n"
-                        f"Expected one of these things: {expected}")
-                case ("shift", state):
-                    stack.append(Node(token, (i, j), source[i:j]))
-                    stack.append(state)
-                    token, (i, j) = self.syntax.scan_token(source, j)
-                case ("reduce", rule):
-                    stack, body = (
-                        stack[: -len(rule.body) * 2],
-                        stack[-len(rule.body) * 2:: 2],
-                    )
-                    state = self.gotos[stack[-1], rule.head]
+            symbol = symbol_ids.get(token)
+            code = 0 if symbol is None else action_table[stack[-1]][symbol]
+            kind, arg = code >> ACTION_ARG_BITS, code & ACTION_ARG_MASK
+            if kind == SHIFT:
+                stack.append(Node(token, (i, j), source[i:j]))
+                stack.append(arg)
+                token, (i, j) = scan_token(source, j)
+            elif kind == REDUCE:
+                if size := rule_lens[arg] * 2:
+                    body = stack[-size::2]
+                    del stack[-size:]
                     span = (body[0].span[0], body[-1].span[-1])
-                    stack.extend([Node(rule.head, span, body), state])
-                case ("accept",):
-                    return stack[1]
+                else:
+                    body, span = [], (i, i)
+                state = goto_table[stack[-1]][int_rules[arg].head]
+                stack.append(Node(rule_table[arg].head, span, body))
+                stack.append(state)
+            elif kind == ACCEPT:
+                return stack[1]
+            else:
+                expected = {tok for i, tok in self.actions if i == stack[-1]}
+                raise ValueError(
+                    f"Unexpected token at [{i}..{j-1}]: {token!r}\n"
+                    f"Expected one of these things: {expected}")
@@ -1,27 +1,47 @@
-from typing import Callable
+from re import compile as regex
+from typing import Any, Callable, Iterable
+
+KeywordTrie = dict[str, Any]
+SPACES = regex(r"[ \t]*")
+SPACES_AND_NEWLINES = regex(r"[ \t\n]*")
 
 
 def get_keyword_parser(keyword: str) -> Callable[[str, int], int]:
+    keyword_len = len(keyword)
+
     def f(source: str, offset: int):
-        if source[offset: offset + len(keyword)] != keyword:
-            raise ValueError("There is no {keyword!r} here")
-        return len(keyword)
+        if not source.startswith(keyword, offset):
+            raise ValueError
+        return keyword_len
 
     return f
 
 
+def get_keyword_trie(keywords: Iterable[str]) -> KeywordTrie:
+    trie: KeywordTrie = {}
+    for keyword in keywords:
+        node = trie
+        for char in keyword:
+            node = node.setdefault(char, {})
+        node[""] = keyword
+    return trie
+
+
+def scan_keyword(trie: KeywordTrie, source: str, offset: int) -> tuple[str | None, int]:
+    keyword, length, node, i = trie.get(""), 0, trie, offset
+    while i < len(source) and (node := node.get(source[i])) is not None:
+        i += 1
+        if "" in node:
+            keyword, length = node[""], i - offset
+    return keyword, length
+
+
 def ignore_spaces(source: str, offset: int) -> int:
-    spaces = 0
-    while offset + spaces < len(source) and source[offset + spaces] in " \t":
-        spaces += 1
-    return spaces
+    return SPACES.match(source, offset).end() - offset  # type: ignore
 
 
 def ignore_spaces_and_newlines(source: str, offset: int) -> int:
-    spaces = 0
-    while offset + spaces < len(source) and source[offset + spaces] in " \t\n":
-        spaces += 1
-    return spaces
+    return SPACES_AND_NEWLINES.match(source, offset).end() - offset  # type: ignore
 
 
 TOKEN_PARSERS = {
@@ -16,26 +16,21 @@ TOKENS = {
     "variable": regex(r"\w+"),
     "comment": regex(r"#.*$", MULTILINE),
 }
+TOKEN = regex(
+    r"(?P<newline>\n)|(?P<space>[^\S\n]+)|"
+    + "|".join(f"(?P<{token}>{re.pattern})" for token, re in TOKENS.items()),
+    MULTILINE,
+)
 
 
 def parse_source(source: str) -> Node:
     tokens, i = [], 0
     while i < len(source):
-        if source[i].isspace():
-            print(f"{source[i]!r} is a space!")
-            if source[i] == "\n":
-                tokens.append(("newline", "\n"))
-            i += 1
-            continue
-        print(f"{source[i]!r} is not a space!")
-        for token, re in TOKENS.items():
-            if match := re.match(source, i):
-                _, j = match.span()
-                tokens.append((token, source[i:j]))
-                i = j
-                break
-        else:
+        if not (match := TOKEN.match(source, i)):
             raise Exception(f"{source[i]!r} is unexpected here!")
+        if match.lastgroup != "space":
+            tokens.append((match.lastgroup, match.group()))
+        i = match.end()
     return tokens
 
 